@@ -1,9 +1,33 @@
 
 import os
 import streamlit as st
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 import zipfile
 import io
+import codecs
+import charset_normalizer
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import h2  # Lets httpx speak HTTP/2
+except ImportError:
+    h2 = None
+import json
+import re
+import hashlib
+import functools
+import itertools
+import tarfile
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ---------- Config ----------
 st.set_page_config(page_title="OpenAI ChatBot & File Editor", page_icon="💬", layout="wide")
@@ -17,6 +41,70 @@ MODEL_OPTIONS = [
     "gpt-4o-mini",
     "o4-mini",
 ]
+TEXT_FILE_TYPES = ["txt", "md", "py", "json", "csv", "yaml", "yml"]
+MAX_EDIT_WORKERS = 8  # Concurrent OpenAI requests for multi-file edits
+OPENAI_MAX_RETRIES = 5
+# Edit requests are throttled below the account's rate limits; lower these to match its usage tier
+OPENAI_REQUESTS_PER_MINUTE = 500
+OPENAI_TOKENS_PER_MINUTE = 450000
+# Token budgets per edit request. The whole file comes back as output, so these are bounded by the
+# model's output limit rather than its (much larger) context window: 16,384 tokens for gpt-4o and
+# gpt-4o-mini, with headroom for edits that make the file longer.
+MAX_EDIT_TOKENS = 12000  # Larger files are split into chunks
+EDIT_CHUNK_TOKENS = 8000
+EDIT_CHUNK_OVERLAP = 2000  # Characters shared by neighbouring chunks
+EDIT_PACK_TOKENS = 8000  # Small files are packed into one JSON request of up to this size
+EDIT_PACK_MAX_FILE_TOKENS = 2000  # Files larger than this are always edited on their own
+# Texts this long are far over MAX_EDIT_TOKENS at any realistic characters-per-token ratio, so their count
+# is extrapolated from a tokenized prefix instead of tokenizing all of it.
+TOKEN_ESTIMATE_MIN_CHARS = 16 * MAX_EDIT_TOKENS
+TOKEN_SAMPLE_CHARS = 64 * 1024
+CHAT_HISTORY_TURNS = 20  # Past user/assistant turns sent with each edit-chat request
+MAX_CHAT_MESSAGES = 2 * CHAT_HISTORY_TURNS  # Stored and rendered per chat panel; older messages are dropped
+CHAT_CONTEXT_TOKENS = 4000  # Past this, the older half of the chatbot history is replaced by a summary
+MAX_PREVIEW_FILE_SIZE = 2 * 1024 * 1024  # Larger ZIP entries are not previewed
+ACE_CACHE_SIZE = 32  # Unsaved editor buffers kept per session
+# Output archives: DEFLATE level 1 is ~3x faster than the default level 6 for a small size cost on text.
+# ZIP_ZSTANDARD (Python 3.14+) would be faster still, but most unzip tools can't open it yet.
+OUTPUT_ZIP_COMPRESSION = zipfile.ZIP_DEFLATED
+OUTPUT_ZIP_COMPRESSLEVEL = 1
+# Copied-over ZIP members with these extensions are already compressed, so they are stored rather than deflated again
+PRECOMPRESSED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".mp4", ".mov", ".pdf",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".jar", ".whl", ".woff", ".woff2",
+}
+# ZIP members that are never sent for editing; anything else is edited if its content sniffs and decodes as text
+BINARY_EXTENSIONS = PRECOMPRESSED_EXTENSIONS | {
+    ".bmp", ".ico", ".ttf", ".otf", ".exe", ".dll", ".so", ".dylib", ".o", ".a", ".pyc", ".class",
+    ".db", ".sqlite",
+}
+OUTPUT_ZSTD_LEVEL = 3  # Used for .tar.zst downloads when zstandard is installed
+EDIT_SYSTEM_PROMPT = (
+    "You are an expert editor. Given file content and user instructions, produce ONLY the fully edited file. "
+    "Preserve the file's format and structure. Do not add explanations or extra text."
+)
+EDIT_DIFF_SYSTEM_PROMPT = (
+    "You are an expert editor. Given file content and user instructions, output ONLY a unified diff "
+    "(diff -u format, with @@ hunk headers and 3 lines of context) that turns the original file into the edited file. "
+    "Output nothing if no change is needed. Do not add explanations, code fences or extra text."
+)
+EDIT_CHUNK_SYSTEM_PROMPT = (
+    "You are an expert editor. You are given one chunk of a larger file and user instructions. "
+    "Return ONLY the rewritten chunk, verbatim where no change is needed, with the same start and end lines. "
+    "Do not renumber anything as if the chunk were the whole file, and do not add explanations, preamble or extra text."
+)
+EDIT_PACK_SYSTEM_PROMPT = (
+    "You are an expert editor. You are given several files as JSON of the form "
+    '{"files": [{"name": ..., "content": ...}]} and user instructions. Apply the instructions to each file '
+    "independently, preserving each file's format and structure. Respond with JSON of the same form containing "
+    "every file with its name unchanged and its fully edited content. Do not add explanations or extra text."
+)
+CHAT_SYSTEM_PROMPT = "You are a helpful chatbot assistant."
+EDIT_CHAT_SYSTEM_PROMPT = "You are a helpful chatbot for file editing and code tasks."
+CHAT_SUMMARY_PROMPT = (
+    "Summarize the following conversation in at most 300 tokens. Keep facts, decisions, names and open "
+    "questions that later replies may need. Write only the summary."
+)
 
 # Sidebar: API key + model selection
 st.sidebar.header("OpenAI Settings")
@@ -26,102 +114,758 @@ custom_model = st.sidebar.text_input("Custom model (optional)", placeholder="Ove
 if custom_model.strip():
     model = custom_model.strip()
 
+use_batch_api = st.sidebar.checkbox(
+    "Use Batch API (cheaper, async)",
+    help="Multi-file edits are submitted as one OpenAI batch job at ~50% of the cost. Jobs can take minutes to hours; collect the results with \"Check batch status\".",
+)
+edit_as_diff = st.sidebar.checkbox(
+    "Request edits as diffs",
+    help="Larger files come back as a unified diff that is applied locally, so unchanged lines cost no output tokens. "
+    "Falls back to the whole file if the diff doesn't apply.",
+)
+# zstd-compressed tar is faster to build and smaller than deflate, but needs the optional zstandard package
+archive_format = st.sidebar.radio(
+    "Download archive format",
+    ["zip", "zip (stored)", "tar.zst"] if zstandard else ["zip", "zip (stored)"],
+    horizontal=True,
+    help="\"zip (stored)\" skips compression: fastest to build, largest to download.",
+)
+
 st.sidebar.caption("Note: There is currently no public model named gpt-5. Select a model above and update the name when a new model becomes available.")
 
 # Initialize OpenAI client only when API key is provided
-client = None
-if api_key:
-    os.environ["OPENAI_API_KEY"] = api_key
-    client = OpenAI()
+@st.cache_resource(show_spinner=False)
+def get_openai_client(api_key):
+    # One client (and HTTP connection pool) per key, reused across reruns and sessions.
+    # Parallel edits can hit rate limits; the SDK retries 429/5xx with exponential backoff.
+    # With HTTP/2 the concurrent edit requests share one multiplexed TLS connection.
+    http_client = DefaultHttpxClient(http2=h2 is not None)
+    return OpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES, http_client=http_client)
+
+client = get_openai_client(api_key) if api_key else None
 
 # ---------- Helpers ----------
 def need_key():
     st.warning("Please enter your OPENAI_API_KEY in the sidebar to use the app.")
     return
 
+# Chat histories are stored as compact (role, content) tuples and only expanded to OpenAI's dict form
+# when sent, keeping session state small for long chats.
+CHAT_ROLES = {"s": "system", "u": "user", "a": "assistant"}
+
+def _to_messages(history):
+    return [{"role": CHAT_ROLES[role], "content": content} for role, content in history]
+
 def ai_chat(messages):
     # messages: list of {"role": "system"|"user"|"assistant", "content": str}
+    # Yields the reply as it is generated; render with st.write_stream, which returns the full text.
     if not client:
         need_key()
-        return ""
+        return
     try:
-        resp = client.chat.completions.create(
+        stream = client.chat.completions.create(
             model=model,
             messages=messages,
             temperature=0.3,
+            stream=True,
         )
-        return resp.choices[0].message.content or ""
+        for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ""
     except Exception as e:
         st.error(f"OpenAI error: {e}")
-        return ""
 
-def edit_file_with_instructions(file_text, instructions):
-    if not client:
-        need_key()
-        return ""
+def trim_history(history, summary=None):
+    # Drops the oldest messages past MAX_CHAT_MESSAGES in place, so the stored history and what each rerun
+    # renders stay bounded. Returns summary with its turn index shifted to match.
+    overflow = len(history) - MAX_CHAT_MESSAGES
+    if overflow <= 0:
+        return summary
+    del history[:overflow]
+    if summary:
+        start, text = summary
+        summary = (max(0, start - overflow), text)
+    return summary
+
+def compress_history(history, summary):
+    # history: [(role, content)] user/assistant turns; summary: (turns covered, summary text) or None.
+    # Once the turns after the summary exceed CHAT_CONTEXT_TOKENS, the older half of them is folded into the
+    # summary with one extra request, so each chat turn sends a bounded prompt.
+    # Returns (turns to send, with the summary as a leading system message, and the updated summary).
+    start, text = summary or (0, "")
+    recent = history[start:]
+    if client and len(recent) > 2 and sum(count_tokens(content for _, content in recent)) > CHAT_CONTEXT_TOKENS:
+        cut = start + len(recent) // 2
+        transcript = "\n\n".join(f"{CHAT_ROLES[role]}: {content}" for role, content in history[start:cut])
+        if text:
+            transcript = f"Summary of the conversation before this: {text}\n\n{transcript}"
+        try:
+            resp = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": CHAT_SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript},
+                ],
+                temperature=0.2,
+            )
+            start, text = cut, resp.choices[0].message.content or text
+        except Exception:
+            pass  # Send the unsummarized turns this time and try again on the next one
+    turns = history[start:]
+    if text:
+        turns = [("s", f"Summary of the earlier conversation: {text}"), *turns]
+    return turns, (start, text)
+
+def _edit_messages(file_text, instructions, system_prompt=EDIT_SYSTEM_PROMPT, position=""):
+    # The file body is its own message so the (possibly large) string is passed through as-is
+    # instead of being copied into a combined prompt. position (e.g. "chunk 2 of 5") goes after the
+    # shared system prompt and instructions, so it doesn't break prompt caching across chunks.
+    opener = f"This is {position} of the file. " if position else ""
+    closer = "Return only the unified diff." if system_prompt == EDIT_DIFF_SYSTEM_PROMPT else "Return only the edited file content."
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": instructions.strip()},
+        {"role": "user", "content": f"{opener}File content between <FILE> and </FILE>:\n<FILE>\n"},
+        {"role": "user", "content": file_text},
+        {"role": "user", "content": f"\n</FILE>\n{closer}"},
+    ]
+
+@st.cache_resource(show_spinner=False)
+def _get_encoding(model):
+    # Tokenizer for the model, or None if tiktoken (or its downloadable encoding data) is unavailable
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+def count_tokens(texts):
+    # Returns the token count of each text. encode_batch tokenizes in parallel outside the GIL.
+    # Without tiktoken, falls back to the usual ~4 characters per token estimate.
+    texts = list(texts)
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return [(len(text) + 3) // 4 for text in texts]
+    samples = [text[:TOKEN_SAMPLE_CHARS] if len(text) > TOKEN_ESTIMATE_MIN_CHARS else text for text in texts]
+    counts = [len(tokens) for tokens in encoding.encode_batch(samples, num_threads=MAX_EDIT_WORKERS, disallowed_special=())]
+    return [
+        n if len(sample) == len(text) else max(n * len(text) // len(sample), MAX_EDIT_TOKENS + 1)
+        for text, sample, n in zip(texts, samples, counts)
+    ]
 
+def _check_edit_size(file_text, n_tokens):
+    # Returns an error message if the file can't be sent as a single (batch) request, else None
     if not file_text:
-        st.error("No file content to edit.")
-        return ""
-    max_chars = 120000  # Adjust if your model/context allows more
-    if len(file_text) > max_chars:
-        st.error(f"File is too large ({len(file_text):,} characters). Please upload a smaller file or split it.")
-        return ""
-
-    system_prompt = (
-        "You are an expert editor. Given file content and user instructions, produce ONLY the fully edited file. "
-        "Preserve the file's format and structure. Do not add explanations or extra text."
+        return "No file content to edit."
+    if n_tokens > MAX_EDIT_TOKENS:
+        return f"Would use {n_tokens:,} input tokens, limit {MAX_EDIT_TOKENS:,}. Turn off the Batch API to edit it in chunks."
+    return None
+
+def _edit_text(file_text, instructions, n_tokens=None):
+    # Returns (edited_content, error_message). Never calls Streamlit, so it is safe to run in worker threads.
+    if not file_text:
+        return "", "No file content to edit."
+    if n_tokens is None:
+        n_tokens = count_tokens([file_text])[0]
+    if n_tokens > MAX_EDIT_TOKENS:
+        return _edit_large_text(file_text, instructions, n_tokens)
+    try:
+        if edit_as_diff:
+            try:
+                diff = _edit_file_cached(model, instructions, file_text, EDIT_DIFF_SYSTEM_PROMPT, _n_tokens=n_tokens)
+                return _apply_unified_diff(file_text, diff), None
+            except ValueError:
+                pass  # The diff didn't apply cleanly; ask for the whole file instead
+        return _edit_file_cached(model, instructions, file_text, _n_tokens=n_tokens), None
+    except Exception as e:
+        return "", f"OpenAI error: {e}"
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+
+def _apply_unified_diff(original, diff):
+    # Returns original with the unified diff applied. Hunks are located by their context and removed lines,
+    # searching forward from the previous hunk, because line numbers written by a model are often off; when the
+    # lines match in several places, the match closest to the header's line number wins, as with patch.
+    # Raises ValueError if the diff can't be parsed or a hunk doesn't match.
+    diff_lines = diff.strip("\n").splitlines()
+    # Models often wrap the diff in a markdown code fence
+    if diff_lines and diff_lines[0].startswith("```"):
+        diff_lines = diff_lines[1:]
+    if diff_lines and diff_lines[-1].startswith("```"):
+        diff_lines = diff_lines[:-1]
+    hunks = []  # [(old start line, [diff lines])]
+    for line in diff_lines:
+        header = _HUNK_HEADER.match(line)
+        if header:
+            hunks.append((int(header.group(1)), []))
+        elif hunks and line[:1] in (" ", "-", "+"):
+            hunks[-1][1].append(line)
+        elif hunks and not line:
+            hunks[-1][1].append(" ")  # Context line for an empty line, trailing space stripped
+        elif hunks and not line.startswith("\\"):
+            raise ValueError(f"Unexpected line in diff: {line[:80]}")
+    if not hunks:
+        if diff.strip():
+            raise ValueError("Reply is not a unified diff")
+        return original
+    newline = "\r\n" if "\r\n" in original else "\n"
+    lines = original.split(newline)
+    out = []
+    pos = 0
+    offset = 0  # How far the previous hunk was from its header's line number
+    for old_start, body in hunks:
+        old = [line[1:] for line in body if line[0] in " -"]
+        new = [line[1:] for line in body if line[0] in " +"]
+        if old:
+            expected = old_start - 1 + offset
+            matches = [i for i in range(pos, len(lines) - len(old) + 1) if lines[i:i + len(old)] == old]
+            if not matches:
+                raise ValueError("Diff does not match the file")
+            start = min(matches, key=lambda i: abs(i - expected))
+            offset = start - (old_start - 1)
+        else:
+            start = min(max(pos, old_start + offset), len(lines))  # Pure insertion: "-N,0" means after line N
+        out.extend(lines[pos:start])
+        out.extend(new)
+        pos = start + len(old)
+    out.extend(lines[pos:])
+    return newline.join(out)
+
+@st.cache_resource(show_spinner=False)
+def _get_rate_limiter(api_key):
+    # Requests of the last minute as (timestamp, tokens) plus their token total, shared by every session
+    # using the key (limits are per key)
+    return {"lock": threading.Lock(), "sent": collections.deque(), "tokens": 0}
+
+def _wait_for_rate_limit(n_tokens=0):
+    # Blocks until one more request of n_tokens fits in the rolling one-minute window of both limits.
+    # A request larger than the whole token budget still goes through once the window is empty.
+    # Safe to call from worker threads.
+    limiter = _get_rate_limiter(api_key)
+    while True:
+        with limiter["lock"]:
+            now = time.monotonic()
+            sent = limiter["sent"]
+            while sent and now - sent[0][0] >= 60:
+                limiter["tokens"] -= sent.popleft()[1]
+            if len(sent) < OPENAI_REQUESTS_PER_MINUTE and (not sent or limiter["tokens"] + n_tokens <= OPENAI_TOKENS_PER_MINUTE):
+                sent.append((now, n_tokens))
+                limiter["tokens"] += n_tokens
+                return
+            wait = 60 - (now - sent[0][0])
+        time.sleep(wait)
+
+def _prompt_cache_key(system_prompt, instructions):
+    # Requests sharing a prompt prefix (system prompt + instructions) are routed together so OpenAI's
+    # automatic prompt caching can reuse it across files. The file content always comes last.
+    return hashlib.blake2b(f"{system_prompt}\0{instructions.strip()}".encode("utf-8"), digest_size=16).hexdigest()
+
+def _reply_text(choice):
+    # A reply cut off at the output limit would be taken as the whole edited file, so it is an error instead
+    if choice.finish_reason == "length":
+        raise RuntimeError("Reply was cut off at the model's output token limit")
+    return choice.message.content or ""
+
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
+def _edit_file_cached(model, instructions, file_text, system_prompt=EDIT_SYSTEM_PROMPT, position="", _n_tokens=0):
+    # Identical (model, instructions, file_text) edits are served from cache. Errors raise and are not cached.
+    # _n_tokens (the file's token count, not part of the cache key) is charged twice to the rate limiter,
+    # since the whole file comes back as output.
+    _wait_for_rate_limit(2 * _n_tokens)
+    resp = client.chat.completions.create(
+        model=model,
+        messages=_edit_messages(file_text, instructions, system_prompt, position),
+        temperature=0.2,
+        prompt_cache_key=_prompt_cache_key(system_prompt, instructions),
     )
-    user_prompt = (
-        f"{instructions.strip()}\n\n"
-        "File content between <FILE> and </FILE>:\n"
-        "<FILE>\n"
-        f"{file_text}\n"
-        "</FILE>\n"
-        "Return only the edited file content."
+    return _reply_text(resp.choices[0])
+
+def _split_into_chunks(text, max_chars, overlap=EDIT_CHUNK_OVERLAP):
+    # Returns [(start, end, chunk)] covering text, split on line boundaries where possible. Consecutive chunks share
+    # roughly `overlap` characters of whole lines so the edited pieces can be stitched back together.
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            if newline > start:
+                end = newline + 1
+        chunks.append((start, end, text[start:end]))
+        if end >= len(text):
+            break
+        if text[end - 1] != "\n":
+            start = end  # A line longer than max_chars is cut mid-line; the pieces are joined without overlap
+            continue
+        next_start = text.rfind("\n", start, max(start, end - overlap)) + 1
+        start = next_start if next_start > start else end
+    return chunks
+
+def _stitch_chunks(file_text, chunks, edited_chunks):
+    # Joins edited chunks, dropping the lines each chunk repeats from the end of the previous one.
+    merged = edited_chunks[0].splitlines(keepends=True)
+    for (_, prev_end, _), (start, _, _), edited in zip(chunks, chunks[1:], edited_chunks[1:]):
+        lines = edited.splitlines(keepends=True)
+        # Restore a newline the model dropped, but not after a chunk that was cut mid-line
+        if merged and not merged[-1].endswith("\n") and file_text[prev_end - 1] == "\n":
+            merged[-1] += "\n"
+        overlap_lines = file_text.count("\n", start, prev_end)
+        # The original overlap length is exact, so try it first. If the model changed the overlapping lines,
+        # look for a slightly shorter match, never a longer one: on repetitive text that would drop real lines.
+        skip = overlap_lines
+        for k in range(overlap_lines, max(0, overlap_lines - 5), -1):
+            if merged[-k:] == lines[:k]:
+                skip = k
+                break
+        merged.extend(lines[skip:])
+    return "".join(merged)
+
+def _edit_large_text(file_text, instructions, n_tokens):
+    # Edits a file that is too large for one request as overlapping chunks, concurrently, then stitches them.
+    # Chunk length in characters follows the file's own characters-per-token ratio.
+    chunks = _split_into_chunks(file_text, max(1000, EDIT_CHUNK_TOKENS * len(file_text) // n_tokens))
+    with ThreadPoolExecutor(max_workers=min(MAX_EDIT_WORKERS, len(chunks))) as executor:
+        futures = [
+            executor.submit(
+                _edit_file_cached, model, instructions, chunk, EDIT_CHUNK_SYSTEM_PROMPT, f"chunk {k} of {len(chunks)}",
+                _n_tokens=n_tokens * len(chunk) // len(file_text),
+            )
+            for k, (_, _, chunk) in enumerate(chunks, 1)
+        ]
+        try:
+            edited_chunks = [future.result() for future in futures]
+        except Exception as e:
+            return "", f"OpenAI error: {e}"
+    return _stitch_chunks(file_text, chunks, edited_chunks), None
+
+def edit_files_with_instructions(file_dict, instructions):
+    # file_dict: {filename: content(str)}
+    # Returns ({filename: edited_content}, [error messages]); errors are returned rather than shown
+    # because the edits run in worker threads, where Streamlit calls are not safe.
+    # Files with identical content are edited once and the result is shared between them.
+    unique = {}  # {content hash: representative filename}
+    representative = {}  # {filename: representative filename}
+    for fname, text in file_dict.items():
+        key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        representative[fname] = unique.setdefault(key, fname)
+    to_edit = {fname: file_dict[fname] for fname in unique.values()}
+    if use_batch_api and to_edit:
+        # Batch jobs finish asynchronously: the results are collected later with "Check batch status"
+        batch_id, errors = submit_edit_batch(to_edit, instructions)
+        if batch_id:
+            st.session_state.pending_batch = {"id": batch_id, "representative": representative}
+        return {}, errors
+    edited, errors = _edit_files_concurrently(to_edit, instructions)
+    return _share_edits(edited, representative), errors
+
+def _share_edits(edited, representative):
+    # Maps the edits of representative files back onto every file that had the same content
+    return {fname: edited[rep] for fname, rep in representative.items() if rep in edited}
+
+def _edit_files_concurrently(file_dict, instructions):
+    edited_files = {}
+    errors = []
+    if not file_dict:
+        return edited_files, errors
+    token_counts = dict(zip(file_dict, count_tokens(file_dict.values())))
+    groups = _pack_small_files(token_counts)
+    # Results are collected on the script thread, so progress can be shown as each request finishes
+    progress = st.progress(0.0, text=f"Edited 0 of {len(file_dict)} file(s)...")
+    done = 0
+    with ThreadPoolExecutor(max_workers=min(MAX_EDIT_WORKERS, len(groups))) as executor:
+        futures = [
+            executor.submit(_edit_group, {name: file_dict[name] for name in names}, instructions, token_counts)
+            for names in groups
+        ]
+        for future in as_completed(futures):
+            for name, (edited, error) in future.result().items():
+                done += 1
+                if error:
+                    errors.append(f"Could not process {name}: {error}")
+                elif edited:
+                    edited_files[name] = edited
+            progress.progress(done / len(file_dict), text=f"Edited {done} of {len(file_dict)} file(s)...")
+    progress.empty()
+    return edited_files, errors
+
+def _pack_small_files(token_counts):
+    # token_counts: {filename: tokens}
+    # First-fit-decreasing packing of small files into groups of at most EDIT_PACK_TOKENS tokens,
+    # so many small files cost one request instead of one each. Returns a list of filename lists.
+    packs = []  # [[used_tokens, [filenames]]]
+    singles = []
+    for name in sorted(token_counts, key=token_counts.get, reverse=True):
+        size = token_counts[name]
+        if not size or size > EDIT_PACK_MAX_FILE_TOKENS:
+            singles.append([name])
+            continue
+        for pack in packs:
+            if pack[0] + size <= EDIT_PACK_TOKENS:
+                pack[0] += size
+                pack[1].append(name)
+                break
+        else:
+            packs.append([size, [name]])
+    return singles + [names for _, names in packs]
+
+def _edit_group(file_dict, instructions, token_counts):
+    # Returns {filename: (edited_content, error_message)}. Groups of several files are edited in one
+    # JSON request; any file missing from that reply (or the whole group, if it fails) is edited on its own.
+    edited = {}
+    if len(file_dict) > 1:
+        payload = json.dumps({"files": [{"name": name, "content": text} for name, text in file_dict.items()]})
+        try:
+            edited = _edit_pack_cached(model, instructions, payload, _n_tokens=sum(token_counts[name] for name in file_dict))
+        except Exception:
+            edited = {}
+    return {
+        name: (edited[name], None) if edited.get(name) else _edit_text(text, instructions, token_counts[name])
+        for name, text in file_dict.items()
+    }
+
+@st.cache_data(show_spinner=False, max_entries=256, ttl=3600)
+def _edit_pack_cached(model, instructions, payload, _n_tokens=0):
+    # Returns {filename: edited_content}. Malformed replies raise, so they are not cached.
+    _wait_for_rate_limit(2 * _n_tokens)
+    resp = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": EDIT_PACK_SYSTEM_PROMPT},
+            {"role": "user", "content": instructions.strip()},
+            {"role": "user", "content": payload},
+        ],
+        temperature=0.2,
+        response_format={"type": "json_object"},
+        prompt_cache_key=_prompt_cache_key(EDIT_PACK_SYSTEM_PROMPT, instructions),
     )
+    files = json.loads(_reply_text(resp.choices[0]))["files"]
+    return {f["name"]: f["content"] for f in files if isinstance(f.get("content"), str)}
+
+def submit_edit_batch(file_dict, instructions):
+    # Submits all edits as a single OpenAI Batch API job without waiting for it.
+    # Returns (batch id or None, [error messages]); collect the results with fetch_edit_batch.
+    errors = []
+    lines = []
+    cache_key = _prompt_cache_key(EDIT_SYSTEM_PROMPT, instructions)
+    for (fname, text), n_tokens in zip(file_dict.items(), count_tokens(file_dict.values())):
+        error = _check_edit_size(text, n_tokens)
+        if error:
+            errors.append(f"Could not process {fname}: {error}")
+            continue
+        lines.append(json.dumps({
+            "custom_id": fname,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": _edit_messages(text, instructions),
+                "temperature": 0.2,
+                "prompt_cache_key": cache_key,
+            },
+        }))
+    if not lines:
+        return None, errors
     try:
-        resp = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.2,
+        jsonl_bytes = ("\n".join(lines) + "\n").encode("utf-8")
+        batch_file = client.files.create(file=("edits.jsonl", io.BytesIO(jsonl_bytes)), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
         )
-        return resp.choices[0].message.content or ""
+        return batch.id, errors
     except Exception as e:
-        st.error(f"OpenAI error: {e}")
-        return ""
+        errors.append(f"OpenAI error: {e}")
+        return None, errors
 
-def edit_zip_with_instructions(zip_bytes, instructions):
-    # Returns: dict of {filename: edited_content}
+def fetch_edit_batch(batch_id):
+    # Returns (status, {filename: edited_content}, [error messages]). Results are only read once the
+    # batch has finished; until then status is the batch's current state and the dict is empty.
     edited_files = {}
-    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
-        for name in zf.namelist():
-            if zf.getinfo(name).is_dir():
+    errors = []
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in ("completed", "failed", "expired", "cancelled"):
+        return batch.status, edited_files, errors
+    if batch.status != "completed":
+        errors.append(f"Batch {batch.id} {batch.status}.")
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            fname = result["custom_id"]
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                choice = response["body"]["choices"][0]
+                content = choice["message"]["content"] or ""
+                if choice.get("finish_reason") == "length":
+                    errors.append(f"Could not process {fname}: reply was cut off at the model's output token limit")
+                elif content:
+                    edited_files[fname] = content
+            else:
+                errors.append(f"Could not process {fname}: {result.get('error') or response.get('body')}")
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if line.strip():
+                result = json.loads(line)
+                errors.append(f"Could not process {result['custom_id']}: {result.get('error')}")
+    return batch.status, edited_files, errors
+
+def _has_binary_extension(filename):
+    return os.path.splitext(filename)[1].lower() in BINARY_EXTENSIONS
+
+def _looks_like_text(b):
+    # Cheap binary sniff: NUL bytes or many control characters near the start mean it isn't text
+    return b"\x00" not in b[:8192] and sum(c < 9 or (13 < c < 32) for c in b[:2048]) < 64
+
+def _decode_text(raw):
+    # Returns the decoded text, or None if the bytes don't look like text in any encoding.
+    # Strict UTF-8 is the fast path; charset detection only runs when that fails.
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    best = charset_normalizer.from_bytes(raw).best()
+    if best is None or best.chaos > 0.3:
+        return None
+    return str(best)
+
+def _decode_preview(head):
+    # Like _decode_text, but for the first bytes of a file: a multi-byte character cut off at the end is ignored
+    try:
+        return codecs.getincrementaldecoder("utf-8")().decode(head)
+    except UnicodeDecodeError:
+        return _decode_text(head)
+
+def edit_zip_with_instructions(zip_file, instructions):
+    # zip_file: seekable file-like object (e.g. the UploadedFile), read in place without copying
+    # Returns: ({filename: edited_content}, [error messages])
+    if not client:
+        need_key()
+        return {}, []
+    # ZipFile is not thread-safe, so extract serially and only parallelize the API calls
+    texts = {}
+    decoded = {}  # {raw content hash: text}, so duplicate members are decoded once and share one string
+    skipped = 0
+    zip_file.seek(0)
+    with zipfile.ZipFile(zip_file) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename
+            if _has_binary_extension(name):
+                skipped += 1
                 continue
             try:
-                raw = zf.read(name)
-                try:
-                    text = raw.decode("utf-8", errors="replace")
-                except Exception:
-                    continue
-                edited = edit_file_with_instructions(text, instructions)
-                if edited:
-                    edited_files[name] = edited
+                # Sniff the start of the entry before inflating the rest, so binary members are never fully read
+                with zf.open(info) as fh:
+                    head = fh.read(8192)
+                    if not _looks_like_text(head):
+                        skipped += 1
+                        continue
+                    raw = head + fh.read()
+                key = hashlib.blake2b(raw, digest_size=16).digest()
+                if key not in decoded:
+                    decoded[key] = _decode_text(raw)
+                text = decoded[key]
+                if text is not None:
+                    texts[name] = text
+                else:
+                    skipped += 1
             except Exception as e:
                 st.warning(f"Could not process {name}: {e}")
-    return edited_files
+    if skipped:
+        st.info(f"Skipped {skipped} binary file(s).")
+    return edit_files_with_instructions(texts, instructions)
 
-def make_zip_from_dict(file_dict):
-    # file_dict: {filename: content(str)}
+# Upload parsing is cached by Streamlit's file_id (unique per upload), so reruns skip the work and the
+# bytes never need hashing. Underscore-prefixed arguments are excluded from the cache key.
+# These caches are shared by all sessions, so entries expire after an hour rather than outliving the upload.
+@st.cache_data(show_spinner=False, max_entries=64, ttl=3600)
+def _decode_upload(file_id, _raw):
+    return _decode_text(_raw)
+
+@st.cache_data(show_spinner=False, max_entries=16, ttl=3600)
+def _load_zip_preview(file_id, _uploaded):
+    # Returns (file_list, {filename: preview}) for up to 10 files
+    _uploaded.seek(0)
+    with zipfile.ZipFile(_uploaded) as zf:
+        # One pass over the central directory, no per-name getinfo lookups
+        infos = [info for info in zf.infolist() if not info.is_dir()]
+        file_list = [info.filename for info in infos]
+        preview = {}
+        for info in itertools.islice(infos, 10):  # preview up to 10 files
+            name = info.filename
+            if info.file_size > MAX_PREVIEW_FILE_SIZE:
+                preview[name] = "[File too large to preview]"
+                continue
+            try:
+                # Only inflate the first few KB of each entry
+                with zf.open(info) as fh:
+                    head = fh.read(2048)
+                if not _looks_like_text(head):
+                    preview[name] = "[Binary file]"
+                    continue
+                text = _decode_preview(head)
+                preview[name] = text[:500] if text is not None else "[Could not decode]"
+            except Exception:
+                preview[name] = "[Could not decode]"
+    return file_list, preview
+
+# Ace editor language per file extension
+_EXT_TO_LANG = {
+    ".py": "python",
+    ".js": "javascript", ".jsx": "javascript",
+    ".ts": "typescript", ".tsx": "typescript",
+    ".json": "json",
+    ".md": "markdown", ".markdown": "markdown",
+    ".yaml": "yaml", ".yml": "yaml",
+    ".html": "html",
+    ".css": "css",
+    ".c": "c_cpp", ".cpp": "c_cpp", ".h": "c_cpp", ".hpp": "c_cpp",
+    ".java": "java",
+    ".go": "go",
+    ".rb": "ruby",
+    ".rs": "rust",
+    ".cs": "csharp",
+    ".php": "php",
+    ".sql": "sql",
+}
+
+# Helper to guess language from filename
+@functools.lru_cache(maxsize=256)
+def guess_language(filename):
+    return _EXT_TO_LANG.get(os.path.splitext(filename)[1].lower(), "plain_text")
+
+def _bounded_setdefault(cache, key, default):
+    # dict.setdefault that evicts the oldest entries once the dict grows past ACE_CACHE_SIZE
+    value = cache.setdefault(key, default)
+    while len(cache) > ACE_CACHE_SIZE:
+        cache.pop(next(iter(cache)))
+    return value
+
+def _source_members(source_zip, file_dict):
+    # Yields (ZipInfo, data) for every member of the uploaded ZIP in archive order, directories included:
+    # the edited text for members in file_dict, the original bytes for the rest, so binaries and skipped
+    # files are carried over unchanged. The source ZipInfo comes along so permissions and timestamps are
+    # kept for edited and unedited members alike.
+    if source_zip is None:
+        return
+    # Download data is built on another thread, so read the archive through its own view of the upload's
+    # bytes rather than moving the file position a concurrent edit may be using. BytesIO shares the buffer.
+    with zipfile.ZipFile(io.BytesIO(source_zip.getvalue())) as zf:
+        for info in zf.infolist():
+            yield info, file_dict[info.filename] if info.filename in file_dict else zf.read(info)
+
+def _tar_info_from_zip(info):
+    # Tar header with a ZIP member's name, type, permissions and timestamp
+    tar_info = tarfile.TarInfo(info.filename.rstrip("/"))
+    if info.is_dir():
+        tar_info.type = tarfile.DIRTYPE
+    # Archives made on Windows carry no Unix mode
+    tar_info.mode = (info.external_attr >> 16) & 0o7777 or (0o755 if info.is_dir() else 0o644)
+    tar_info.mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+    return tar_info
+
+def make_zip_from_dict(file_dict, compression=OUTPUT_ZIP_COMPRESSION, source_zip=None):
+    # file_dict: {filename: content(str)}; source_zip: optional original archive, whose member order and metadata
+    # are kept and whose unedited members are copied over
+    # Returns the archive as bytes
     mem_zip = io.BytesIO()
-    with zipfile.ZipFile(mem_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+    written = set()
+    with zipfile.ZipFile(mem_zip, "w", compression, compresslevel=OUTPUT_ZIP_COMPRESSLEVEL) as zf:
+        for info, data in _source_members(source_zip, file_dict):
+            if info.is_dir() or os.path.splitext(info.filename)[1].lower() in PRECOMPRESSED_EXTENSIONS:
+                zf.writestr(info, data, compress_type=zipfile.ZIP_STORED)
+            else:
+                zf.writestr(info, data, compress_type=compression, compresslevel=OUTPUT_ZIP_COMPRESSLEVEL)
+            written.add(info.filename)
         for fname, content in file_dict.items():
-            zf.writestr(fname, content)
-    mem_zip.seek(0)
-    return mem_zip
+            if fname not in written:
+                zf.writestr(fname, content)
+    return mem_zip.getvalue()
+
+def make_tar_zst_from_dict(file_dict, source_zip=None):
+    # Same as make_zip_from_dict, as a tar streamed through zstd's multi-threaded compressor
+    mem_tar = io.BytesIO()
+    cctx = zstandard.ZstdCompressor(level=OUTPUT_ZSTD_LEVEL, threads=-1)
+    with cctx.stream_writer(mem_tar, closefd=False) as zst_stream:
+        with tarfile.open(fileobj=zst_stream, mode="w|") as tf:
+            written = set()
+            for zip_info, data in _source_members(source_zip, file_dict):
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                info = _tar_info_from_zip(zip_info)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+                written.add(zip_info.filename)
+            for fname, content in file_dict.items():
+                if fname not in written:
+                    data = content.encode("utf-8")
+                    info = tarfile.TarInfo(fname)
+                    info.size = len(data)
+                    info.mtime = int(time.time())
+                    tf.addfile(info, io.BytesIO(data))
+    return mem_tar.getvalue()
+
+def archive_download(file_dict, source_zip=None):
+    # Returns (data, file extension, mime type) for st.download_button in the format picked in the sidebar.
+    # data is a callable, so the archive is only built when the button is clicked, not on every rerun.
+    if archive_format == "tar.zst":
+        return functools.partial(make_tar_zst_from_dict, file_dict, source_zip), ".tar.zst", "application/zstd"
+    if archive_format == "zip (stored)":
+        return functools.partial(make_zip_from_dict, file_dict, zipfile.ZIP_STORED, source_zip), ".zip", "application/zip"
+    return functools.partial(make_zip_from_dict, file_dict, source_zip=source_zip), ".zip", "application/zip"
+
+def _edit_run_key(instructions, *parts):
+    # Digest of everything an edit run depends on, used to skip re-running an identical edit
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model, "diff" if edit_as_diff else "full", instructions, *parts):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.digest()
+
+def _edit_state_defaults():
+    # Fresh objects on every call, so sessions never share a mutable default
+    return {
+        "file_contents": {},  # {filename: content}
+        "file_names": [],
+        "is_zip": False,
+        "zip_file_list": [],
+        "zip_preview": {},
+        "selected_file": None,
+        "edited_files": {},  # {filename: edited_content}
+        "edited_zip": {},
+        "edited_content": "",
+        "zip_upload": None,
+        "last_edit_key": None,  # _edit_run_key of the run that produced the current results
+        "pending_batch": None,  # {"id": batch id, "representative": {filename: filename}} while a batch runs
+    }
+
+def _reset_edit_state():
+    # Drops everything derived from the current uploads, including the Ace editor content caches
+    for key, value in _edit_state_defaults().items():
+        st.session_state[key] = value
+    st.session_state.pop("ace_editor_content", None)
+    st.session_state.pop("ace_edited_content", None)
+
+def _clear_uploads():
+    # Button callback: a new uploader key drops the uploaded files, and everything derived from them goes too
+    st.session_state.upload_generation += 1
+    st.session_state.upload_key = None
+    _reset_edit_state()
+
+def _reset_chat():
+    # Button callbacks run before the rerun the click triggers, so the cleared history renders without a second rerun
+    st.session_state.chat_history = []
+    st.session_state.chat_summary = None
+
+def _reset_edit_chat():
+    st.session_state.edit_chat_history = []
 
 # ---------- UI ----------
 st.title("OpenAI ChatBot + File Editor")
@@ -129,105 +873,123 @@ st.title("OpenAI ChatBot + File Editor")
 tab_chat, tab_edit = st.tabs(["Chatbot", "Edit file(s)"])
 
 # ----- Chatbot tab -----
-with tab_chat:
+# Each chat panel is a fragment: sending a message or resetting only reruns the panel, not the whole app
+@st.fragment
+def _render_chat():
     if "chat_history" not in st.session_state:
-        st.session_state.chat_history = [
-            {"role": "system", "content": "You are a helpful chatbot assistant."}
-        ]
+        st.session_state.chat_history = []
+    st.session_state.setdefault("chat_summary", None)  # (turns covered, text), see compress_history
 
     # --- Move chat input to bottom, messages always scroll to bottom ---
-    chat_messages = st.session_state.chat_history[1:]  # skip system
+    chat_messages = st.session_state.chat_history
     chat_container = st.container()
     with chat_container:
-        for msg in chat_messages:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
+        for role, content in chat_messages:
+            with st.chat_message(CHAT_ROLES[role]):
+                st.write(content)
 
     user_msg = st.chat_input("Type your message")
     if user_msg:
-        st.session_state.chat_history.append({"role": "user", "content": user_msg})
+        st.session_state.chat_history.append(("u", user_msg))
         with chat_container:
             with st.chat_message("user"):
                 st.write(user_msg)
 
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
-                    reply = ai_chat(st.session_state.chat_history)
-                    st.write(reply)
+                    turns, st.session_state.chat_summary = compress_history(
+                        st.session_state.chat_history, st.session_state.chat_summary
+                    )
+                    reply = st.write_stream(ai_chat(_to_messages([("s", CHAT_SYSTEM_PROMPT), *turns])))
         if reply:
-            st.session_state.chat_history.append({"role": "assistant", "content": reply})
+            st.session_state.chat_history.append(("a", reply))
+        st.session_state.chat_summary = trim_history(st.session_state.chat_history, st.session_state.chat_summary)
 
     col1, _ = st.columns(2)
     with col1:
-        if st.button("Reset chatbot"):
-            st.session_state.chat_history = [{"role": "system", "content": "You are a helpful chatbot assistant."}]
-            st.rerun()
+        st.button("Reset chatbot", on_click=_reset_chat)
+
+with tab_chat:
+    _render_chat()
 
 # ----- Edit file tab -----
+@st.fragment
+def _render_edit_chat():
+    st.markdown("**Chatbot: Ask about your file(s) or instructions**")
+    if "edit_chat_history" not in st.session_state:
+        st.session_state.edit_chat_history = []
+    # --- Move chat input to bottom, messages always scroll to bottom ---
+    edit_chat_messages = st.session_state.edit_chat_history
+    edit_chat_container = st.container()
+    with edit_chat_container:
+        for role, content in edit_chat_messages:
+            with st.chat_message(CHAT_ROLES[role], avatar="💬"):
+                st.write(content)
+    edit_user_msg = st.chat_input("Ask the chatbot about your file(s) or instructions", key="edit_chat_input")
+    if edit_user_msg:
+        st.session_state.edit_chat_history.append(("u", edit_user_msg))
+        with edit_chat_container:
+            with st.chat_message("user", avatar="💬"):
+                st.write(edit_user_msg)
+            with st.chat_message("assistant", avatar="💬"):
+                with st.spinner("Thinking..."):
+                    # Add file content and instructions to the context for the AI
+                    context = ""
+                    if st.session_state.is_zip and st.session_state.zip_file_list:
+                        context = f"ZIP file containing: {', '.join(st.session_state.zip_file_list[:10])}..."
+                    elif st.session_state.file_names:
+                        context = f"Project files: {', '.join(st.session_state.file_names[:10])}..."
+                        if st.session_state.selected_file:
+                            context += f"\nPreview of {st.session_state.selected_file}:\n{st.session_state.file_contents.get(st.session_state.selected_file, '')[:500]}"
+                    history = st.session_state.edit_chat_history
+                    chat_messages = [
+                        ("s", EDIT_CHAT_SYSTEM_PROMPT),
+                        ("u", f"Current file(s) preview:\n{context}\n\nCurrent instructions:\n{st.session_state.get('edit_instructions', '')}"),
+                        *history[-2 * CHAT_HISTORY_TURNS:],
+                    ]
+                    reply = st.write_stream(ai_chat(_to_messages(chat_messages)))
+        if reply:
+            st.session_state.edit_chat_history.append(("a", reply))
+        trim_history(st.session_state.edit_chat_history)
+    st.button("Reset chatbot (edit)", key="reset_edit_chat", on_click=_reset_edit_chat)
+
 with tab_edit:
     st.subheader("Upload one or more text files, or a zip archive, to edit")
+    st.session_state.setdefault("upload_generation", 0)  # Bumped by "Clear uploads" to reset the uploader
     uploaded_files = st.file_uploader(
         "Supported types: txt, md, py, json, csv, yaml, yml, zip",
-        type=["txt", "md", "py", "json", "csv", "yaml", "yml", "zip"],
+        type=TEXT_FILE_TYPES + ["zip"],
         accept_multiple_files=True,
-        key="multi_file_upload",
+        key=f"multi_file_upload_{st.session_state.upload_generation}",
+    )
+    # Stays enabled after the files are removed with the uploader's ✕, since the state built from them is still held
+    st.button(
+        "Clear uploads",
+        on_click=_clear_uploads,
+        disabled=not uploaded_files and st.session_state.get("upload_key") is None,
     )
 
-    # Session state for multi-file support
-    if "file_contents" not in st.session_state:
-        st.session_state.file_contents = {}  # {filename: content}
-    if "file_names" not in st.session_state:
-        st.session_state.file_names = []
-    if "is_zip" not in st.session_state:
-        st.session_state.is_zip = False
-    if "zip_file_list" not in st.session_state:
-        st.session_state.zip_file_list = []
-    if "zip_preview" not in st.session_state:
-        st.session_state.zip_preview = {}
-    if "selected_file" not in st.session_state:
-        st.session_state.selected_file = None
-    if "edited_files" not in st.session_state:
-        st.session_state.edited_files = {}  # {filename: edited_content}
-    if "edited_zip" not in st.session_state:
-        st.session_state.edited_zip = {}
-    if "edited_content" not in st.session_state:
-        st.session_state.edited_content = ""
-    if "zip_bytes" not in st.session_state:
-        st.session_state.zip_bytes = None
-
-    # Handle uploads
-    if uploaded_files:
-        st.session_state.file_contents = {}
-        st.session_state.file_names = []
-        st.session_state.is_zip = False
-        st.session_state.zip_file_list = []
-        st.session_state.zip_preview = {}
-        st.session_state.selected_file = None
-        st.session_state.edited_files = {}
-        st.session_state.edited_zip = {}
-        st.session_state.edited_content = ""
-        st.session_state.zip_bytes = None
+    # Session state for multi-file support, set up once per session
+    if "upload_key" not in st.session_state:
+        st.session_state.upload_key = None  # file_ids of the uploads the state was built from
+        _reset_edit_state()
+
+    # Handle uploads. Only a new set of uploads resets the state, so reruns keep editor changes and results.
+    upload_key = tuple(uploaded.file_id for uploaded in uploaded_files) if uploaded_files else None
+    if uploaded_files and upload_key != st.session_state.upload_key:
+        st.session_state.upload_key = upload_key
+        _reset_edit_state()
 
         # If only one file and it's a zip, treat as zip
         if len(uploaded_files) == 1 and uploaded_files[0].name.lower().endswith(".zip"):
             uploaded = uploaded_files[0]
             st.session_state.is_zip = True
+            st.session_state.zip_upload = uploaded
             try:
-                uploaded.seek(0)
-                zip_bytes = uploaded.read()
-                st.session_state.zip_bytes = zip_bytes
-                with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
-                    file_list = [name for name in zf.namelist() if not zf.getinfo(name).is_dir()]
-                    st.session_state.zip_file_list = file_list
-                    preview = {}
-                    for name in file_list[:10]:  # preview up to 10 files
-                        try:
-                            raw = zf.read(name)
-                            text = raw.decode("utf-8", errors="replace")
-                            preview[name] = text[:500]
-                        except Exception:
-                            preview[name] = "[Could not decode]"
-                    st.session_state.zip_preview = preview
+                # UploadedFile is seekable, so the archive is always read in place rather than copied to bytes
+                file_list, preview = _load_zip_preview(uploaded.file_id, uploaded)
+                st.session_state.zip_file_list = file_list
+                st.session_state.zip_preview = preview
                 st.session_state.file_names = file_list
                 st.success(f"Loaded ZIP: {uploaded.name} ({len(file_list)} files)")
             except Exception as e:
@@ -239,8 +1001,10 @@ with tab_edit:
             # Multiple files (or single non-zip)
             for uploaded in uploaded_files:
                 try:
-                    raw = uploaded.read()
-                    text = raw.decode("utf-8", errors="replace")
+                    text = _decode_upload(uploaded.file_id, uploaded.getvalue())
+                    if text is None:
+                        st.error(f"Failed to read file {uploaded.name}: not a text file or unknown encoding")
+                        continue
                     st.session_state.file_contents[uploaded.name] = text
                     st.session_state.file_names.append(uploaded.name)
                 except Exception as e:
@@ -253,45 +1017,7 @@ with tab_edit:
     # Move chatbot and instructions to the top of the tab
     col_chat, col_edit = st.columns([1, 2])
     with col_chat:
-        st.markdown("**Chatbot: Ask about your file(s) or instructions**")
-        if "edit_chat_history" not in st.session_state:
-            st.session_state.edit_chat_history = [
-                {"role": "system", "content": "You are a helpful chatbot for file editing and code tasks."}
-            ]
-        # --- Move chat input to bottom, messages always scroll to bottom ---
-        edit_chat_messages = st.session_state.edit_chat_history[1:]  # skip system
-        edit_chat_container = st.container()
-        with edit_chat_container:
-            for msg in edit_chat_messages:
-                with st.chat_message(msg["role"], avatar="💬"):
-                    st.write(msg["content"])
-        edit_user_msg = st.chat_input("Ask the chatbot about your file(s) or instructions", key="edit_chat_input")
-        if edit_user_msg:
-            st.session_state.edit_chat_history.append({"role": "user", "content": edit_user_msg})
-            with edit_chat_container:
-                with st.chat_message("user", avatar="💬"):
-                    st.write(edit_user_msg)
-                with st.chat_message("assistant", avatar="💬"):
-                    with st.spinner("Thinking..."):
-                        # Add file content and instructions to the context for the AI
-                        context = ""
-                        if st.session_state.is_zip and st.session_state.zip_file_list:
-                            context = f"ZIP file containing: {', '.join(st.session_state.zip_file_list[:10])}..."
-                        elif st.session_state.file_names:
-                            context = f"Project files: {', '.join(st.session_state.file_names[:10])}..."
-                            if st.session_state.selected_file:
-                                context += f"\nPreview of {st.session_state.selected_file}:\n{st.session_state.file_contents.get(st.session_state.selected_file, '')[:500]}"
-                        chat_messages = st.session_state.edit_chat_history.copy()
-                        chat_messages.insert(1, {"role": "user", "content": f"Current file(s) preview:\n{context}\n\nCurrent instructions:\n{st.session_state.get('edit_instructions', '')}"})
-                        reply = ai_chat(chat_messages)
-                        st.write(reply)
-            if reply:
-                st.session_state.edit_chat_history.append({"role": "assistant", "content": reply})
-        if st.button("Reset chatbot (edit)", key="reset_edit_chat"):
-            st.session_state.edit_chat_history = [
-                {"role": "system", "content": "You are a helpful chatbot for file editing and code tasks."}
-            ]
-            st.rerun()
+        _render_edit_chat()
     with col_edit:
         instructions = st.text_area(
             "Editing instructions",
@@ -336,37 +1062,86 @@ with tab_edit:
     # Edit button and logic
     if st.button("Run edit", type="primary", disabled=run_edit_disabled):
         if st.session_state.is_zip and st.session_state.zip_file_list:
-            with st.spinner("Editing all files in ZIP with OpenAI..."):
-                zip_bytes = st.session_state.zip_bytes
-                edited_files = edit_zip_with_instructions(zip_bytes, instructions)
-                if edited_files:
-                    st.session_state.edited_zip = edited_files
-                    st.session_state.edited_files = {}
-                    st.session_state.edited_content = ""
-                    st.success(f"Edited {len(edited_files)} files in ZIP.")
-                else:
-                    st.session_state.edited_zip = {}
-                    st.session_state.edited_files = {}
-                    st.session_state.edited_content = ""
+            run_key = _edit_run_key(instructions, st.session_state.zip_upload.file_id)
+            if run_key == st.session_state.last_edit_key and st.session_state.edited_zip:
+                st.info("Nothing changed since the last run; showing the previous results.")
+            else:
+                with st.spinner("Editing all files in ZIP with OpenAI..."):
+                    edited_files, errors = edit_zip_with_instructions(st.session_state.zip_upload, instructions)
+                    for error in errors:
+                        st.warning(error)
+                    if edited_files:
+                        st.session_state.edited_zip = edited_files
+                        st.session_state.edited_files = {}
+                        st.session_state.edited_content = ""
+                        # Only a clean run is skipped next time; after errors, Run edit retries the failed files
+                        st.session_state.last_edit_key = None if errors else run_key
+                        st.success(f"Edited {len(edited_files)} files in ZIP.")
+                    else:
+                        st.session_state.edited_zip = {}
+                        st.session_state.edited_files = {}
+                        st.session_state.edited_content = ""
+                        st.session_state.last_edit_key = None
         elif st.session_state.file_names:
-            st.session_state.edited_files = {}
-            with st.spinner("Editing all files with OpenAI..."):
-                for fname in st.session_state.file_names:
-                    content = st.session_state.file_contents.get(fname, "")
-                    if content.strip():
-                        edited = edit_file_with_instructions(content, instructions)
-                        if edited:
-                            st.session_state.edited_files[fname] = edited
-                if st.session_state.edited_files:
-                    st.session_state.edited_content = ""
-                    st.session_state.edited_zip = {}
-                    st.success(f"Edited {len(st.session_state.edited_files)} file(s).")
-                else:
-                    st.session_state.edited_content = ""
-                    st.session_state.edited_zip = {}
+            to_edit = {}
+            for fname in st.session_state.file_names:
+                content = st.session_state.file_contents.get(fname, "")
+                if content.strip():
+                    to_edit[fname] = content
+            run_key = _edit_run_key(instructions, *(part for item in to_edit.items() for part in item))
+            if run_key == st.session_state.last_edit_key and st.session_state.edited_files:
+                st.info("Nothing changed since the last run; showing the previous results.")
+            else:
+                st.session_state.edited_files = {}
+                with st.spinner("Editing all files with OpenAI..."):
+                    errors = []
+                    if not client:
+                        need_key()
+                    else:
+                        edited, errors = edit_files_with_instructions(to_edit, instructions)
+                        for error in errors:
+                            st.error(error)
+                        st.session_state.edited_files = edited
+                    if st.session_state.edited_files:
+                        st.session_state.edited_content = ""
+                        st.session_state.edited_zip = {}
+                        st.session_state.last_edit_key = None if errors else run_key
+                        st.success(f"Edited {len(st.session_state.edited_files)} file(s).")
+                    else:
+                        st.session_state.edited_content = ""
+                        st.session_state.edited_zip = {}
+                        st.session_state.last_edit_key = None
         else:
             st.warning("No file(s) to edit.")
 
+    pending_batch = st.session_state.pending_batch
+    if pending_batch:
+        st.info(f"Batch {pending_batch['id']} submitted. Batch jobs can take up to 24 hours to complete.")
+        if st.button("Check batch status"):
+            if not client:
+                need_key()
+            else:
+                try:
+                    batch_status, edited, errors = fetch_edit_batch(pending_batch["id"])
+                except Exception as e:
+                    batch_status, edited, errors = None, {}, [f"OpenAI error: {e}"]
+                for error in errors:
+                    st.error(error)
+                if batch_status in ("completed", "failed", "expired", "cancelled"):
+                    st.session_state.pending_batch = None
+                    edited = _share_edits(edited, pending_batch["representative"])
+                    if st.session_state.is_zip:
+                        st.session_state.edited_zip = edited
+                        st.session_state.edited_files = {}
+                    else:
+                        st.session_state.edited_files = edited
+                        st.session_state.edited_zip = {}
+                    st.session_state.edited_content = ""
+                    if edited:
+                        st.success(f"Edited {len(edited)} file(s).")
+                elif batch_status:
+                    st.info(f"Batch {pending_batch['id']} is {batch_status}.")
+
     edited_files = st.session_state.get("edited_files", {})
     edited_zip = st.session_state.get("edited_zip", {})
     edited_content = st.session_state.get("edited_content", "")
@@ -389,60 +1164,25 @@ with tab_edit:
         "c_cpp", "java", "go", "ruby", "rust", "csharp", "php", "sql", "plain_text"
     ]
 
-    # Helper to guess language from filename
-    def guess_language(filename):
-        ext = os.path.splitext(filename)[1].lower()
-        if ext == ".py":
-            return "python"
-        if ext in [".js", ".jsx"]:
-            return "javascript"
-        if ext in [".ts", ".tsx"]:
-            return "typescript"
-        if ext == ".json":
-            return "json"
-        if ext in [".md", ".markdown"]:
-            return "markdown"
-        if ext in [".yaml", ".yml"]:
-            return "yaml"
-        if ext == ".html":
-            return "html"
-        if ext == ".css":
-            return "css"
-        if ext in [".c", ".cpp", ".h", ".hpp"]:
-            return "c_cpp"
-        if ext == ".java":
-            return "java"
-        if ext == ".go":
-            return "go"
-        if ext == ".rb":
-            return "ruby"
-        if ext == ".rs":
-            return "rust"
-        if ext in [".cs"]:
-            return "csharp"
-        if ext == ".php":
-            return "php"
-        if ext in [".sql"]:
-            return "sql"
-        return "plain_text"
-
     # --- Single file VS Code-style editor ---
-    if st_ace and st.session_state.file_names and not st.session_state.is_zip:
+    # Fragment: typing in the editor, switching theme or saving reruns only the editor
+    @st.fragment
+    def _render_editor(selected_file):
         st.markdown("### VS Code-style File Editor")
         editor_col, theme_col = st.columns([5, 1])
         with theme_col:
             ace_theme = st.selectbox("Editor Theme", ACE_THEMES, index=ACE_THEMES.index("monokai"), key="ace_theme")
         with editor_col:
-            selected_file = st.session_state.selected_file
             language = guess_language(selected_file)
             # Use session state to preserve edits before saving
-            if "ace_editor_content" not in st.session_state:
-                st.session_state.ace_editor_content = {}
-            if selected_file not in st.session_state.ace_editor_content:
-                st.session_state.ace_editor_content[selected_file] = st.session_state.file_contents.get(selected_file, "")
+            editor_value = _bounded_setdefault(
+                st.session_state.setdefault("ace_editor_content", {}),
+                selected_file,
+                st.session_state.file_contents.get(selected_file, ""),
+            )
             # VS Code-style Ace editor
             ace_content = st_ace(
-                value=st.session_state.ace_editor_content[selected_file],
+                value=editor_value,
                 language=language,
                 theme=ace_theme,
                 keybinding="vscode",
@@ -459,24 +1199,33 @@ with tab_edit:
             )
             st.session_state.ace_editor_content[selected_file] = ace_content
 
+            # Save is disabled while the editor matches the saved text, so no-op saves don't cost a rerun
             save_col, _ = st.columns([1, 5])
             with save_col:
-                if st.button("💾 Save", key=f"save_{selected_file}"):
+                if st.button(
+                    "💾 Save",
+                    key=f"save_{selected_file}",
+                    disabled=ace_content == st.session_state.file_contents.get(selected_file, ""),
+                ):
                     st.session_state.file_contents[selected_file] = ace_content
                     st.success(f"Saved changes to {selected_file}.")
 
+    if st_ace and st.session_state.file_names and not st.session_state.is_zip:
+        _render_editor(st.session_state.selected_file)
+
     # --- Edited files download and preview ---
     if st.session_state.is_zip and edited_zip:
         st.markdown("**Edited files in ZIP:**")
-        for fname, content in list(edited_zip.items())[:5]:
+        for fname, content in itertools.islice(edited_zip.items(), 5):
             st.markdown(f"**{fname}**")
             st.code(content[:500], language="")
-        mem_zip = make_zip_from_dict(edited_zip)
+        # Members that weren't edited (binaries, skipped files) are copied over from the uploaded archive
+        zip_data, archive_ext, archive_mime = archive_download(edited_zip, st.session_state.zip_upload)
         st.download_button(
             "Download edited ZIP",
-            data=mem_zip,
-            file_name=f"edited_project.zip",
-            mime="application/zip",
+            data=zip_data,
+            file_name=f"edited_project{archive_ext}",
+            mime=archive_mime,
         )
     elif edited_files:
         st.markdown("**Edited project files:**")
@@ -489,12 +1238,13 @@ with tab_edit:
         if st_ace:
             ace_theme = st.session_state.get("ace_theme", "monokai")
             language = guess_language(selected_edited)
-            if "ace_edited_content" not in st.session_state:
-                st.session_state.ace_edited_content = {}
-            if selected_edited not in st.session_state.ace_edited_content:
-                st.session_state.ace_edited_content[selected_edited] = edited_files[selected_edited]
+            edited_value = _bounded_setdefault(
+                st.session_state.setdefault("ace_edited_content", {}),
+                selected_edited,
+                edited_files[selected_edited],
+            )
             ace_edited_content = st_ace(
-                value=st.session_state.ace_edited_content[selected_edited],
+                value=edited_value,
                 language=language,
                 theme=ace_theme,
                 keybinding="vscode",
@@ -512,12 +1262,17 @@ with tab_edit:
             st.session_state.ace_edited_content[selected_edited] = ace_edited_content
             save_col, _ = st.columns([1, 5])
             with save_col:
-                if st.button("💾 Save (edited)", key=f"save_edited_{selected_edited}"):
+                if st.button(
+                    "💾 Save (edited)",
+                    key=f"save_edited_{selected_edited}",
+                    disabled=ace_edited_content == edited_files[selected_edited],
+                ):
                     st.session_state.edited_files[selected_edited] = ace_edited_content
                     st.success(f"Saved changes to {selected_edited}.")
+            # Download data is passed as a callable, so the file is only encoded when the button is clicked
             st.download_button(
                 "Download edited file",
-                data=ace_edited_content.encode("utf-8"),
+                data=functools.partial(str.encode, ace_edited_content),
                 file_name=f"edited_{selected_edited}",
                 mime="text/plain",
                 key="download_single_edited_file",
@@ -531,17 +1286,17 @@ with tab_edit:
             )
             st.download_button(
                 "Download edited file",
-                data=edited_files[selected_edited].encode("utf-8"),
+                data=functools.partial(str.encode, edited_files[selected_edited]),
                 file_name=f"edited_{selected_edited}",
                 mime="text/plain",
                 key="download_single_edited_file",
             )
-        mem_zip = make_zip_from_dict(edited_files)
+        zip_data, archive_ext, archive_mime = archive_download(edited_files)
         st.download_button(
             "Download all edited files as ZIP",
-            data=mem_zip,
-            file_name="edited_project.zip",
-            mime="application/zip",
+            data=zip_data,
+            file_name=f"edited_project{archive_ext}",
+            mime=archive_mime,
             key="download_all_edited_files_zip",
         )
     elif edited_content:
@@ -565,12 +1320,12 @@ with tab_edit:
             )
             save_col, _ = st.columns([1, 5])
             with save_col:
-                if st.button("💾 Save (single edited)", key="save_single_edited"):
+                if st.button("💾 Save (single edited)", key="save_single_edited", disabled=ace_content == edited_content):
                     st.session_state.edited_content = ace_content
                     st.success("Saved changes.")
             st.download_button(
                 "Download edited file",
-                data=ace_content.encode("utf-8"),
+                data=functools.partial(str.encode, ace_content),
                 file_name="edited_file.txt",
                 mime="text/plain",
             )
@@ -583,7 +1338,7 @@ with tab_edit:
             if edited_content:
                 st.download_button(
                     "Download edited file",
-                    data=edited_content.encode("utf-8"),
+                    data=functools.partial(str.encode, edited_content),
                     file_name="edited_file.txt",
                     mime="text/plain",
                 )
@@ -0,0 +1,47 @@
+import logging
+import os
+import runpy
+import unittest
+
+# MyChatBot.py is a Streamlit script; running it outside `streamlit run` renders nothing, so its helpers can be used directly
+logging.disable(logging.CRITICAL)
+APP = runpy.run_path(os.path.join(os.path.dirname(__file__), os.pardir, "MyChatBot.py"))
+split_into_chunks = APP["_split_into_chunks"]
+stitch_chunks = APP["_stitch_chunks"]
+
+
+class StitchChunksTest(unittest.TestCase):
+    def assert_round_trip(self, text, max_chars=10000):
+        chunks = split_into_chunks(text, max_chars)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(stitch_chunks(text, chunks, [chunk for _, _, chunk in chunks]), text)
+
+    def test_code(self):
+        self.assert_round_trip("".join(f"def f{i}(x):\n    return x + {i}\n\n" for i in range(3000)))
+
+    def test_repeated_line(self):
+        self.assert_round_trip("x\n" * 50000)
+
+    def test_repeated_blank_lines(self):
+        self.assert_round_trip("a\n\n\n" * 30000)
+
+    def test_no_trailing_newline(self):
+        self.assert_round_trip("y\n" * 20000 + "end")
+
+    def test_line_longer_than_chunk(self):
+        self.assert_round_trip("var a=1;" * 40000)
+
+    def test_single_line_json(self):
+        self.assert_round_trip("[" + ",".join('{"id": %d, "name": "row"}' % i for i in range(8000)) + "]\n")
+
+    def test_newline_then_long_line(self):
+        self.assert_round_trip("\n" + "B" * 50000 + "\nend\n")
+
+    def test_short_lines_then_long_line(self):
+        # The first chunk ends before the overlap length, so the overlap search must stay inside the chunk
+        text = "id,blob\n" + "1," + "A" * 100000 + "\n" + "".join(f"{i},row\n" for i in range(2, 30000))
+        self.assert_round_trip(text, max_chars=80000)
+
+
+if __name__ == "__main__":
+    unittest.main()
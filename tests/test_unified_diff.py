@@ -0,0 +1,30 @@
+import logging
+import os
+import runpy
+import unittest
+
+logging.disable(logging.CRITICAL)
+APP = runpy.run_path(os.path.join(os.path.dirname(__file__), os.pardir, "MyChatBot.py"))
+apply_unified_diff = APP["_apply_unified_diff"]
+
+
+class ApplyUnifiedDiffTest(unittest.TestCase):
+    def test_applies_hunk(self):
+        diff = "--- a/f\n+++ b/f\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+        self.assertEqual(apply_unified_diff("a\nb\nc\n", diff), "a\nB\nc\n")
+
+    def test_repeated_block_uses_header_line(self):
+        diff = "@@ -3,2 +3,2 @@\n x\n-y\n+Y\n"
+        self.assertEqual(apply_unified_diff("x\ny\nx\ny\n", diff), "x\ny\nx\nY\n")
+
+    def test_code_fence_is_ignored(self):
+        diff = "```diff\n@@ -1,2 +1,2 @@\n a\n-b\n+B\n```"
+        self.assertEqual(apply_unified_diff("a\nb\n", diff), "a\nB\n")
+
+    def test_mismatch_raises(self):
+        with self.assertRaises(ValueError):
+            apply_unified_diff("a\nb\n", "@@ -1,1 +1,1 @@\n-z\n+Z\n")
+
+
+if __name__ == "__main__":
+    unittest.main()